@@ -1,16 +1,20 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-import time
-import pytz
+import numpy as np
 import io
+import hmac
+import hashlib
 from datetime import datetime
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
 from streamlit_gsheets import GSheetsConnection
+from gspread.utils import rowcol_to_a1
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- 1. CONFIGURATION & VISUALS ---
 st.set_page_config(page_title="IC Audit Pro", layout="wide", page_icon="🛡️")
 
-st.markdown("""
+CSS = """
 <style>
     div[data-testid="metric-container"] {
         background-color: #262730 !important;
@@ -24,98 +28,397 @@ st.markdown("""
     div[data-testid="stExpander"] { background-color: #262730; border-radius: 10px; }
     .stButton>button { border-radius: 20px; font-weight: bold; }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def _inject_css():
+    st.markdown(CSS, unsafe_allow_html=True)
+
+_inject_css()
 
 # --- 2. CONSTANTS ---
 BRANCH_OPTIONS = ["NAL","PET","DMP","MND","ADT","BRG","MIN","KSH","RSH","DMN","BNH","ALX","XND","SAN","SMO","TNT","ZGZ"]
 TASK_OPTIONS = ["Cash", "Operation", "C.S"]
-EGYPT_TZ = pytz.timezone('Africa/Cairo')
+STATUS_OPTIONS = ["Completed", "In Progress"]
+EDITOR_COLUMNS = ['Employee', 'Task Description', 'Branch', 'Completion Status', 'Number of Transaction', 'Number of Findings']
+COMPLETION_FIELDS = ['Number of Transaction', 'Number of Findings', 'Completion Status', 'Completion Date', 'Completion Time', 'Duration', 'Progress %']
+TASK_COLUMNS = ["Employee", "Task Description", "Branch", "Assigned Date", "Assigned Time", "Completion Status", "Completion Date", "Completion Time", "Duration", "Progress %", "Journal Date", "Number of Findings", "Number of Transaction"]
+EGYPT_TZ = ZoneInfo('Africa/Cairo')
 
 # --- 3. SMART DATE FUNCTIONS ---
 def get_current_time():
     return datetime.now(EGYPT_TZ)
 
-def parse_date_robustly(date_val):
-    if pd.isna(date_val) or date_val == "": return None
-    if isinstance(date_val, (pd.Timestamp, datetime)): return date_val
-    date_str = str(date_val).strip()
-    for fmt in ['%d/%b/%Y', '%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d', '%Y/%m/%d']:
-        try: return datetime.strptime(date_str, fmt)
-        except ValueError: continue
-    return None
-
-def calculate_duration(start_date, start_time, end_date, end_time):
-    try:
-        s_date = parse_date_robustly(start_date)
-        e_date = parse_date_robustly(end_date)
-        if not s_date or not e_date: return "0h 0m"
-
-        s_time_str = str(start_time).strip()
-        e_time_str = str(end_time).strip()
-        if len(s_time_str.split(':')) == 2: s_time_str += ":00"
-        if len(e_time_str.split(':')) == 2: e_time_str += ":00"
-
-        dt_start = datetime.combine(s_date.date(), datetime.strptime(s_time_str, '%I:%M:%S %p').time())
-        dt_end = datetime.combine(e_date.date(), datetime.strptime(e_time_str, '%I:%M:%S %p').time())
-        diff = dt_end - dt_start
-        secs = diff.total_seconds()
-        if secs < 0: return "0h 0m"
-        return f"{int(secs // 3600)}h {int((secs % 3600) // 60)}m"
-    except: return "0h 0m"
+# Legacy layouts: m/d/Y (d/m/Y when the month is out of range), Y-m-d and Y/m/d, with an optional time suffix
+_DATE_RE = (r'^(?:(?P<p>\d{1,2})/(?P<q>\d{1,2})/(?P<y>\d{4})|(?P<iy>\d{4})(?P<sep>[-/])(?P<im>\d{1,2})(?P=sep)(?P<id>\d{1,2}))'
+            r'(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?$')
+
+def _ymd(y, m, d):
+    return pd.to_datetime(pd.DataFrame({'year': y, 'month': m, 'day': d}), errors='coerce')
+
+def parse_dates(series):
+    # Parse each distinct cell once and map back by code; sheets repeat a handful of dates across many rows
+    codes, uniques = pd.factorize(series)
+    u = pd.Series(uniques, dtype=object)
+    parsed = pd.to_datetime(u, format='%d/%b/%Y', errors='coerce')
+    rest = parsed.isna() & (u.astype(str).str.strip() != "")
+    if rest.any():
+        g = u[rest].astype(str).str.strip().str.extract(_DATE_RE).drop(columns='sep').astype(float)
+        parsed[rest] = _ymd(g['y'], g['p'], g['q']).fillna(_ymd(g['y'], g['q'], g['p'])).fillna(_ymd(g['iy'], g['im'], g['id']))
+    return pd.Series(np.append(parsed.to_numpy(), np.datetime64('NaT'))[codes], index=series.index)
+
+def format_dates(series):
+    codes, uniques = pd.factorize(series)
+    labels = np.append(uniques.strftime('%d/%b/%Y').to_numpy(dtype=object), None)
+    return pd.Series(labels[codes], index=series.index)
+
+def time_of_day(time_s):
+    t = time_s.astype(str).str.strip().str.replace(r'^(\d{1,2}:\d{2})(\s)', r'\1:00\2', regex=True)
+    clock = pd.to_datetime(t, format='%I:%M:%S %p', errors='coerce')
+    return clock - clock.dt.normalize()
+
+def calculate_duration(start_dt, end_dt):
+    if pd.isna(start_dt) or pd.isna(end_dt): return "0h 0m"
+    secs = int((end_dt - start_dt).total_seconds())
+    if secs < 0: return "0h 0m"
+    h, rem = divmod(secs, 3600)
+    return f"{h}h {rem // 60}m"
 
 # --- 4. DATABASE FUNCTIONS ---
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def as_category(series, known):
+    extra = [v for v in pd.unique(series.dropna()) if v not in known]
+    return pd.Categorical(series, categories=list(known) + extra)
+
+@st.cache_resource
+def _get_conn():
+    return st.connection("gsheets", type=GSheetsConnection)
+
+class SheetReadError(Exception):
+    pass
+
+def _read_sheet(worksheet):
+    return _get_conn().read(worksheet=worksheet, ttl=0)
+
+# The single cache layer over both reads: one TTL, and any write clears it whole so no half can outlive the other
+@st.cache_data(ttl=60, show_spinner=False)
+def load_sheets():
+    with ThreadPoolExecutor(2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as ex:
+        f_tasks = ex.submit(_read_sheet, "Tasks")
+        f_users = ex.submit(_read_sheet, "Users")
+        try: tasks_df, users_df = f_tasks.result(), f_users.result()
+        except Exception as e: raise SheetReadError(e) from e
+    if tasks_df is None: tasks_df = pd.DataFrame()
+    if users_df is None: users_df = pd.DataFrame()
+    # object, not pandas 3's inferred str dtype: completion writes put numbers (Progress %) into padded/text columns
+    tasks_df = tasks_df.reindex(columns=tasks_df.columns.union(TASK_COLUMNS, sort=False), fill_value="").astype(object)
+    user_index = {}
+    if not users_df.empty:
+        users_df['Username'] = users_df['Username'].astype(str)
+        users_df['Password'] = users_df['Password'].astype(str)
+        user_index = {u: (hash_password(p), r) for u, p, r in users_df[['Username', 'Password', 'Role']].itertuples(index=False)}
+
+    for col, known in [('Branch', BRANCH_OPTIONS), ('Task Description', TASK_OPTIONS), ('Completion Status', STATUS_OPTIONS), ('Employee', [])]:
+        tasks_df[col] = as_category(tasks_df[col], known)
+    counters = ['Number of Transaction', 'Number of Findings']
+    tasks_df[counters] = tasks_df[counters].apply(pd.to_numeric, errors='coerce').fillna(0).astype('int32')
+
+    tasks_df['_completed'] = tasks_df['Completion Status'].values == 'Completed'
+    tasks_df['_assigned_day'] = parse_dates(tasks_df['Assigned Date']).dt.normalize()
+    tasks_df['_assigned_dt'] = tasks_df['_assigned_day'] + time_of_day(tasks_df['Assigned Time'])
+    # Row positions per employee, not sub-frames: cache_data unpickles its result every rerun, and sub-frames would copy the data twice
+    user_rows = tasks_df.groupby('Employee', sort=False, observed=True).indices
+    return tasks_df, users_df, user_index, user_rows, datetime.now()
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def build_logic_df(_tasks_df, loaded_at):
+    # Admin-only view with parsed dates; keyed on the load stamp rather than hashing the frame
+    journal_day = parse_dates(_tasks_df['Journal Date']).dt.normalize()
+    return _tasks_df.assign(**{'Journal Date': journal_day, 'Assigned Date': _tasks_df['_assigned_day'], '_journal_day': journal_day})
+
 def get_data():
-    conn = st.connection("gsheets", type=GSheetsConnection)
+    # Only a failed read (quota, network) means "cool down"; schema and parsing errors must surface
+    try: return load_sheets()
+    except SheetReadError: return pd.DataFrame(), pd.DataFrame(), {}, {}, None
+    except Exception as e: st.exception(e); st.stop()
+
+def mark_complete(tasks_df, idx, nt, nf, assigned_dt):
+    now = get_current_time()
+    dur = calculate_duration(assigned_dt, now.replace(tzinfo=None))
+    tasks_df.loc[idx, COMPLETION_FIELDS] = [nt, nf, 'Completed', now.strftime('%d/%b/%Y'), now.strftime('%I:%M:%S %p'), dur, 1]
+
+def _prepare_for_sheet(df):
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith('_')])
+    df = df.astype({c: object for c in df.select_dtypes('category').columns})
+    for col in ['Assigned Date', 'Completion Date', 'Journal Date']:
+        if col in df.columns:
+            parsed = parse_dates(df[col])
+            df[col] = format_dates(parsed).where(parsed.notna(), df[col])
+    return df.fillna("")
+
+@st.cache_resource
+def _spreadsheet():
+    # Not public API: GSheetsConnection._instance is the service-account client, and its _open_spreadsheet()
+    # returns the gspread Spreadsheet (written against st-gsheets-connection 0.1.x, pinned in requirements.txt)
+    client = getattr(_get_conn(), '_instance', None)
+    if not callable(getattr(client, '_open_spreadsheet', None)):
+        raise RuntimeError("st-gsheets-connection no longer exposes _instance._open_spreadsheet(); update _spreadsheet() for this version")
+    return client._open_spreadsheet()
+
+def _worksheet(worksheet_name):
+    return _spreadsheet().worksheet(worksheet_name)
+
+def _header(ws):
+    return {h: j for j, h in enumerate(ws.row_values(1), 1) if h}
+
+def _header_runs(header, columns):
+    # One [first_col, last_col, names] run per block of adjacent sheet columns, so cells outside `columns` are never touched
+    runs = []
+    for j, c in sorted((header[c], c) for c in columns):
+        if runs and j == runs[-1][1] + 1: runs[-1][1] = j; runs[-1][2].append(c)
+        else: runs.append([j, j, [c]])
+    return runs
+
+def update_data(df, worksheet_name):
+    try:
+        df = _prepare_for_sheet(df)
+        # Non-app columns are rewritten as read; pandas names blank header cells "Unnamed: N", so restore them blank
+        df.columns = ["" if str(c).startswith("Unnamed:") else c for c in df.columns]
+        _get_conn().update(worksheet=worksheet_name, data=df)
+        load_sheets.clear()
+        return True
+    except Exception as e:
+        st.error(f"⚠️ Save Error: {e}"); return False
+
+def update_rows(df, changes, worksheet_name):
+    # changes = {row index: [columns to write]}; a column the sheet header lacks falls back to a full write, which adds it
     try:
-        tasks_df = conn.read(worksheet="Tasks", ttl=0)
-        users_df = conn.read(worksheet="Users", ttl=0)
-        if tasks_df is None: tasks_df = pd.DataFrame()
-        if users_df is None: users_df = pd.DataFrame()
-        cols_needed = ["Employee", "Task Description", "Branch", "Assigned Date", "Assigned Time", "Completion Status", "Completion Date", "Completion Time", "Duration", "Progress %", "Journal Date", "Number of Findings", "Number of Transaction"]
-        for col in cols_needed:
-            if col not in tasks_df.columns: tasks_df[col] = ""
-        return conn, tasks_df, users_df
-    except: return conn, pd.DataFrame(), pd.DataFrame()
-
-def update_data(conn, df, worksheet_name):
+        ws = _worksheet(worksheet_name)
+        header = _header(ws)
+        cols = list(dict.fromkeys(c for cs in changes.values() for c in cs))
+        if any(c not in header for c in cols): return update_data(df, worksheet_name)
+        prepared = _prepare_for_sheet(df.loc[list(changes), cols]).astype(object)
+        batch = []
+        for idx, cs in changes.items():
+            r = df.index.get_loc(idx) + 2
+            for first, last, names in _header_runs(header, cs):
+                batch.append({'range': f"{rowcol_to_a1(r, first)}:{rowcol_to_a1(r, last)}", 'values': [[prepared.at[idx, c] for c in names]]})
+        ws.batch_update(batch)
+        load_sheets.clear()
+        return True
+    except Exception as e:
+        st.error(f"⚠️ Save Error: {e}"); return False
+
+def append_row(df, row, worksheet_name):
     try:
-        for col in ['Assigned Date', 'Completion Date', 'Journal Date']:
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: parse_date_robustly(x).strftime('%d/%b/%Y') if parse_date_robustly(x) else x)
-        df = df.fillna("") 
-        conn.update(worksheet=worksheet_name, data=df)
-        st.cache_data.clear()
+        ws = _worksheet(worksheet_name)
+        names = ws.row_values(1)
+        # Also covers an empty sheet (no header row yet): the full write creates the header
+        if any(c not in names for c in row): return update_data(pd.concat([df, pd.DataFrame([row])], ignore_index=True), worksheet_name)
+        prepared = _prepare_for_sheet(pd.DataFrame([row], columns=df.columns))
+        rec = dict(zip(prepared.columns, prepared.astype(object).values.tolist()[0]))
+        ws.append_row([rec.get(h, "") for h in names])
+        load_sheets.clear()
         return True
     except Exception as e:
         st.error(f"⚠️ Save Error: {e}"); return False
 
-# --- 5. VISUAL STYLING (STREAMLIT) ---
+def append_task(tasks_df, employee, task, branch, journal_date):
+    now = get_current_time()
+    nr = {'Employee': employee, 'Task Description': task, 'Branch': branch, 
+          'Assigned Date': now.strftime('%d/%b/%Y'), 'Assigned Time': now.strftime('%I:%M:%S %p'),
+          'Journal Date': journal_date.strftime('%d/%b/%Y'), 'Completion Status': 'In Progress', 
+          'Number of Findings': 0, 'Number of Transaction': 0}
+    return append_row(tasks_df, nr, "Tasks")
+
+# --- 5. ANALYTICS HELPERS ---
+def _hash_series(series):
+    return len(series), int(pd.util.hash_pandas_object(series, index=False).sum())
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.Series: _hash_series})
+def date_options(series):
+    return pd.DatetimeIndex(np.unique(series.dropna().to_numpy())).date.tolist()
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.Series: _hash_series})
+def value_options(series):
+    return list(series.unique())
+
+def run_sql(df, q):
+    # Imported on use so only admins running a query pay for duckdb; in-memory sqlite covers a missing install
+    try:
+        import duckdb
+    except ImportError:
+        import sqlite3
+        with sqlite3.connect(':memory:') as c:
+            df.to_sql('df', c, index=False)
+            return pd.read_sql_query(q, c)
+    with duckdb.connect() as c:
+        c.register('df', df)
+        return c.execute(q).df()
+
+# --- 6. VISUAL STYLING (STREAMLIT) ---
 def color_status(val):
     if val == 'Completed': return 'background-color: #90EE90; color: black; font-weight: bold;'
     elif val == 'In Progress': return 'background-color: #FFB347; color: black; font-weight: bold;'
     return ''
 
-# --- 6. MAIN APPLICATION ---
+def notify(msg, kind="success", balloons=False):
+    st.session_state.notice = (msg, kind, balloons)
+    st.rerun()
+
+def show_notice():
+    if 'notice' in st.session_state:
+        msg, kind, balloons = st.session_state.pop('notice')
+        if balloons: st.balloons()
+        if msg: st.toast(msg, icon="✅" if kind == "success" else "⚠️")
+
+# --- 7. REPORT EXPORT ---
+def _write_frame(ws, row, df, fmt_head):
+    # constant_memory flushes row by row, so cells must go out in row order (to_excel writes column-major)
+    ws.write_row(row, 0, df.columns.tolist(), fmt_head)
+    for r, rec in enumerate(df.astype(object).where(df.notna(), None).values.tolist(), row + 1): ws.write_row(r, 0, rec)
+
+@st.cache_data(max_entries=5, ttl=600, show_spinner=False)
+def build_report_excel(summ, det_df):
+    buffer = io.BytesIO()
+    opts = {'constant_memory': True, 'strings_to_urls': False, 'strings_to_formulas': False}
+    with pd.ExcelWriter(buffer, engine='xlsxwriter', engine_kwargs={'options': opts}) as writer:
+        wb = writer.book
+        ws = wb.add_worksheet('Audit Report')
+        writer.sheets['Audit Report'] = ws
+
+        # Formats
+        fmt_head = wb.add_format({'bold': True, 'border': 1})
+        fmt_green = wb.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'})
+        fmt_orange = wb.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C0006'})
+
+        # Write Summary
+        ws.write_string(0, 0, "EXECUTIVE SUMMARY", wb.add_format({'bold':True, 'font_size':14}))
+        _write_frame(ws, 2, summ, fmt_head)
+        ws.conditional_format(3, 4, 3+len(summ), 4, {'type': 'data_bar', 'bar_color': '#63C384'})
+
+        # Write Detail
+        start_row = len(summ) + 6
+        ws.write_string(start_row, 0, "DETAILED AUDIT LOG", wb.add_format({'bold':True, 'font_size':14}))
+        _write_frame(ws, start_row+2, det_df, fmt_head)
+
+        # Highlight Status
+        if 'Completion Status' in det_df.columns:
+            status_col_idx = det_df.columns.get_loc('Completion Status')
+            ws.conditional_format(start_row+3, status_col_idx, start_row+3+len(det_df), status_col_idx,
+                                  {'type': 'cell', 'criteria': '==', 'value': '"Completed"', 'format': fmt_green})
+            ws.conditional_format(start_row+3, status_col_idx, start_row+3+len(det_df), status_col_idx,
+                                  {'type': 'cell', 'criteria': '==', 'value': '"In Progress"', 'format': fmt_orange})
+
+        for i, col in enumerate(summ.columns): ws.set_column(i, i, 15)
+    return buffer.getvalue()
+
+# --- 8. ADMIN TABS ---
+@st.fragment
+def analytics_tab(tasks_df_logic):
+    st.header("Drill-Down Analysis")
+    if tasks_df_logic.empty: st.info("No data available.")
+    else:
+        c1, c2, c3, c4, c5 = st.columns(5)
+        df = tasks_df_logic
+        mask = np.ones(len(df), dtype=bool)
+        with c1: 
+            d = date_options(df['_journal_day'][mask]) if '_journal_day' in df else []
+            if d: 
+                s = st.multiselect("Journal Date", d); 
+                if s: mask &= df['_journal_day'].isin(pd.to_datetime(s)).to_numpy()
+        with c2:
+            d = date_options(df['_assigned_day'][mask]) if '_assigned_day' in df else []
+            if d:
+                s = st.multiselect("Assigned Date", d)
+                if s: mask &= df['_assigned_day'].isin(pd.to_datetime(s)).to_numpy()
+        with c3:
+            o = value_options(df['Branch'][mask]) if 'Branch' in df else []
+            s = st.multiselect("Branch", o)
+            if s and len(s) != len(o): mask &= df['Branch'].isin(s).to_numpy()
+        with c4:
+            o = value_options(df['Task Description'][mask]) if 'Task Description' in df else []
+            s = st.multiselect("Task", o)
+            if s and len(s) != len(o): mask &= df['Task Description'].isin(s).to_numpy()
+        with c5:
+            o = value_options(df['Employee'][mask]) if 'Employee' in df else []
+            s = st.multiselect("Employee", o)
+            if s and len(s) != len(o): mask &= df['Employee'].isin(s).to_numpy()
+        df_f = df.loc[mask]
+
+        st.divider()
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Audits", len(df_f))
+        k2.metric("Findings", int(df_f['Number of Findings'].sum()))
+        k3.metric("Transactions", f"{int(df_f['Number of Transaction'].sum()):,}")
+        k4.metric("Branches", df_f['Branch'].nunique())
+
+        st.subheader("Detailed Audit List")
+        if not df_f.empty:
+            cols = ['Employee', 'Branch', 'Task Description', 'Assigned Date', 'Assigned Time', 'Journal Date', 'Completion Date', 'Completion Time', 'Duration', 'Number of Transaction', 'Number of Findings']
+            disp = df_f[[c for c in cols if c in df_f.columns]].copy()
+            for c in ['Assigned Date', 'Journal Date']:
+                if c in disp.columns: disp[c] = format_dates(disp[c])
+            disp.index = range(1, len(disp)+1)
+            st.dataframe(disp, use_container_width=True)
+
+@st.fragment
+def my_tasks_tab(tasks_df, user_rows, user):
+    st.header("⚡ My Active Tasks")
+    mine = tasks_df.iloc[user_rows.get(user['Username'], [])]
+    my_act = mine[~mine['_completed'].values]
+    if my_act.empty: st.success("No pending tasks.")
+    cols = ['Task Description', 'Branch', 'Number of Transaction', 'Number of Findings', '_assigned_dt']
+    for idx, task, branch, n_trans, n_find, assigned_dt in my_act[cols].itertuples(index=True, name=None):
+        with st.expander(f"📌 {task} @ {branch}", expanded=True):
+            with st.form(key=f"adm_tsk_{idx}"):
+                c1, c2 = st.columns(2)
+                nt = c1.number_input("Trans", value=int(n_trans))
+                nf = c2.number_input("Finds", value=int(n_find))
+                if st.form_submit_button("✅ Complete", type="primary"):
+                    mark_complete(tasks_df, idx, nt, nf, assigned_dt)
+                    if update_rows(tasks_df, {idx: COMPLETION_FIELDS}, "Tasks"): notify(None, balloons=True)
+
+@st.fragment
+def manage_tasks_tab(tasks_df):
+    st.markdown("#### 🛠️ Manage Tasks (Edit, Force Complete or Delete)")
+    fb = st.selectbox("Filter Branch", ["All"] + BRANCH_OPTIONS)
+    dv = tasks_df if fb == "All" else tasks_df[tasks_df['Branch'] == fb]
+    counters = ['Number of Transaction', 'Number of Findings']
+    view = dv[EDITOR_COLUMNS].assign(Complete=False, Delete=False)
+    edited = st.data_editor(view, disabled=EDITOR_COLUMNS[:4], use_container_width=True, key=f"edt_{fb}")
+
+    if st.button("💾 Save Changes", type="primary"):
+        edited[counters] = edited[counters].fillna(0).astype('int32')
+        changed = edited.index[(edited[counters].values != view[counters].values).any(axis=1)]
+        to_complete = edited.index[edited['Complete'].values & (edited['Completion Status'].values != 'Completed')]
+        to_delete = edited.index[edited['Delete'].values]
+        if not (len(changed) or len(to_complete) or len(to_delete)): st.info("No changes to save.")
+        else:
+            # Edit a copy: fragment reruns reuse tasks_df, so it must not show values a failed write never stored.
+            # On success notify() reruns the whole app, which reloads tasks_df from the cleared cache.
+            new = tasks_df.copy()
+            new.loc[changed, counters] = edited.loc[changed, counters].values
+            for idx in to_complete: mark_complete(new, idx, edited.at[idx, counters[0]], edited.at[idx, counters[1]], new.at[idx, '_assigned_dt'])
+            # Deletes shift every row below them, so they need a full rewrite; edits alone go out as a range batch
+            if len(to_delete): ok = update_data(new.drop(to_delete), "Tasks")
+            else: ok = update_rows(new, {**{i: counters for i in changed}, **{i: COMPLETION_FIELDS for i in to_complete}}, "Tasks")
+            if ok: notify("Saved", kind="warning" if len(to_delete) else "success", balloons=bool(len(to_complete)))
+
+# --- 9. MAIN APPLICATION ---
 def main():
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
         st.session_state.user_info = None
 
-    conn, tasks_df, users_df = get_data()
+    tasks_df, users_df, user_index, user_rows, loaded_at = get_data()
+    show_notice()
 
     if users_df.empty:
         st.warning("⚠️ **System Cooling Down**"); st.info("Please wait 60s."); st.stop() 
 
-    users_df['Username'] = users_df['Username'].astype(str)
-    users_df['Password'] = users_df['Password'].astype(str)
-    
-    tasks_df_logic = tasks_df.copy()
-    if not tasks_df_logic.empty:
-        for col in ['Number of Findings', 'Number of Transaction']:
-            if col in tasks_df_logic.columns: tasks_df_logic[col] = pd.to_numeric(tasks_df_logic[col], errors='coerce').fillna(0)
-        for col in ['Journal Date', 'Assigned Date']:
-            if col in tasks_df_logic.columns: tasks_df_logic[col] = tasks_df_logic[col].apply(parse_date_robustly)
-
     # LOGIN
     if not st.session_state.logged_in:
         st.markdown("<h1 style='text-align: center;'>🛡️ IC Audit Portal</h1>", unsafe_allow_html=True)
@@ -124,10 +427,10 @@ def main():
             with st.form("login_form"):
                 u = st.text_input("Username"); p = st.text_input("Password", type="password")
                 if st.form_submit_button("Login Securely", type="primary"):
-                    user = users_df[(users_df['Username'] == u) & (users_df['Password'] == p)]
-                    if not user.empty:
+                    entry = user_index.get(u)
+                    if entry and hmac.compare_digest(entry[0], hash_password(p)):
                         st.session_state.logged_in = True
-                        st.session_state.user_info = user.iloc[0]; st.rerun()
+                        st.session_state.user_info = {'Username': u, 'Role': entry[1]}; st.rerun()
                     else: st.error("❌ Access Denied")
         return
 
@@ -141,130 +444,39 @@ def main():
     # ADMIN
     if user['Role'] == 'Admin':
         st.title("📊 Executive Dashboard")
+        tasks_df_logic = build_logic_df(tasks_df, loaded_at) if loaded_at else tasks_df
         tabs = st.tabs(["📈 Analytics", "⚡ My Tasks", "📝 Manage Tasks", "➕ Assign Task", "💻 SQL Tool", "👥 User Mgmt", "📑 Custom Report"])
 
         # 1. Analytics
         with tabs[0]:
-            st.header("Drill-Down Analysis")
-            if tasks_df_logic.empty: st.info("No data available.")
-            else:
-                c1, c2, c3, c4, c5 = st.columns(5)
-                df_f = tasks_df_logic.copy()
-                with c1: 
-                    d = sorted(df_f['Journal Date'].dropna().dt.date.unique()) if 'Journal Date' in df_f else []
-                    if d: 
-                        s = st.multiselect("Journal Date", d); 
-                        if s: df_f = df_f[df_f['Journal Date'].dt.date.isin(s)]
-                with c2:
-                    d = sorted(df_f['Assigned Date'].dropna().dt.date.unique()) if 'Assigned Date' in df_f else []
-                    if d:
-                        s = st.multiselect("Assigned Date", d)
-                        if s: df_f = df_f[df_f['Assigned Date'].dt.date.isin(s)]
-                with c3:
-                    o = list(df_f['Branch'].unique()) if 'Branch' in df_f else []
-                    s = st.multiselect("Branch", o)
-                    if s: df_f = df_f[df_f['Branch'].isin(s)]
-                with c4:
-                    o = list(df_f['Task Description'].unique()) if 'Task Description' in df_f else []
-                    s = st.multiselect("Task", o)
-                    if s: df_f = df_f[df_f['Task Description'].isin(s)]
-                with c5:
-                    o = list(df_f['Employee'].unique()) if 'Employee' in df_f else []
-                    s = st.multiselect("Employee", o)
-                    if s: df_f = df_f[df_f['Employee'].isin(s)]
-
-                st.divider()
-                k1, k2, k3, k4 = st.columns(4)
-                k1.metric("Audits", len(df_f))
-                k2.metric("Findings", int(df_f['Number of Findings'].sum() if 'Number of Findings' in df_f else 0))
-                k3.metric("Transactions", f"{int(df_f['Number of Transaction'].sum() if 'Number of Transaction' in df_f else 0):,}")
-                k4.metric("Branches", df_f['Branch'].nunique() if 'Branch' in df_f else 0)
-
-                st.subheader("Detailed Audit List")
-                if not df_f.empty:
-                    cols = ['Employee', 'Branch', 'Task Description', 'Assigned Date', 'Assigned Time', 'Journal Date', 'Completion Date', 'Completion Time', 'Duration', 'Number of Transaction', 'Number of Findings']
-                    disp = df_f[[c for c in cols if c in df_f.columns]].copy()
-                    for c in ['Assigned Date', 'Journal Date']:
-                        if c in disp.columns: disp[c] = disp[c].dt.strftime('%d/%b/%Y')
-                    disp.index = range(1, len(disp)+1)
-                    st.dataframe(disp, use_container_width=True)
+            analytics_tab(tasks_df_logic)
 
         # 2. My Tasks
         with tabs[1]:
-            st.header("⚡ My Active Tasks")
-            mask = (tasks_df['Completion Status'] != 'Completed') & (tasks_df['Employee'] == user['Username'])
-            my_act = tasks_df[mask].copy()
-            if my_act.empty: st.success("No pending tasks.")
-            for idx, row in my_act.iterrows():
-                with st.expander(f"📌 {row['Task Description']} @ {row['Branch']}", expanded=True):
-                    with st.form(key=f"adm_tsk_{idx}"):
-                        c1, c2 = st.columns(2)
-                        nt = c1.number_input("Trans", value=int(float(row.get('Number of Transaction',0) or 0)))
-                        nf = c2.number_input("Finds", value=int(float(row.get('Number of Findings',0) or 0)))
-                        if st.form_submit_button("✅ Complete", type="primary"):
-                            now = get_current_time()
-                            cd, ct = now.strftime('%d/%b/%Y'), now.strftime('%I:%M:%S %p')
-                            dur = calculate_duration(row.get('Assigned Date'), row.get('Assigned Time'), cd, ct)
-                            tasks_df.loc[idx, ['Number of Transaction','Number of Findings','Completion Status','Completion Date','Completion Time','Duration','Progress %']] = [nt, nf, 'Completed', cd, ct, dur, 1]
-                            if update_data(conn, tasks_df, "Tasks"): st.balloons(); time.sleep(2); st.rerun()
+            my_tasks_tab(tasks_df, user_rows, user)
 
         # 3. Edit & Force Complete (UPDATED)
         with tabs[2]:
-            st.markdown("#### 🛠️ Manage Tasks (Edit or Force Complete)")
-            fb = st.selectbox("Filter Branch", ["All"] + BRANCH_OPTIONS)
-            dv = tasks_df.copy()
-            if fb != "All": dv = dv[dv['Branch'] == fb]
-            for idx, row in dv.iterrows():
-                with st.expander(f"{'✅' if row['Completion Status']=='Completed' else '⏳'} {row['Employee']} | {row['Task Description']} @ {row['Branch']}"):
-                    with st.form(key=f"edt_{idx}"):
-                        c1, c2 = st.columns(2)
-                        nt = c1.number_input("Trans", value=int(float(row.get('Number of Transaction',0) or 0)))
-                        nf = c2.number_input("Finds", value=int(float(row.get('Number of Findings',0) or 0)))
-                        
-                        # Three Buttons: Update, Force Complete, Delete
-                        c_upd, c_comp, c_del = st.columns(3)
-                        
-                        if c_upd.form_submit_button("💾 Update"):
-                            tasks_df.loc[idx, ['Number of Transaction','Number of Findings']] = [nt, nf]
-                            if update_data(conn, tasks_df, "Tasks"): st.success("Saved"); time.sleep(2); st.rerun()
-                        
-                        # NEW: Force Complete Button
-                        if c_comp.form_submit_button("✅ Force Complete"):
-                            now = get_current_time()
-                            cd, ct = now.strftime('%d/%b/%Y'), now.strftime('%I:%M:%S %p')
-                            dur = calculate_duration(row.get('Assigned Date'), row.get('Assigned Time'), cd, ct)
-                            tasks_df.loc[idx, ['Number of Transaction','Number of Findings','Completion Status','Completion Date','Completion Time','Duration','Progress %']] = [nt, nf, 'Completed', cd, ct, dur, 1]
-                            if update_data(conn, tasks_df, "Tasks"): st.balloons(); st.success("Task Completed for User!"); time.sleep(2); st.rerun()
-
-                        if c_del.form_submit_button("🗑️ Delete"):
-                            tasks_df = tasks_df.drop(idx)
-                            if update_data(conn, tasks_df, "Tasks"): st.warning("Deleted"); time.sleep(2); st.rerun()
+            manage_tasks_tab(tasks_df)
 
         # 4. Assign
         with tabs[3]:
             st.markdown("#### ➕ Assign")
             with st.form("new_task"):
                 c1, c2 = st.columns(2)
-                tgt = c1.selectbox("User", users_df['Username'].unique())
+                tgt = c1.selectbox("User", tuple(user_index))
                 brn = c2.selectbox("Branch", BRANCH_OPTIONS)
                 typ = c1.selectbox("Task", TASK_OPTIONS)
                 jdt = c2.date_input("Journal Date")
                 if st.form_submit_button("Assign", type="primary"):
-                    now = get_current_time()
-                    nr = {'Employee': tgt, 'Task Description': typ, 'Branch': brn, 
-                          'Assigned Date': now.strftime('%d/%b/%Y'), 'Assigned Time': now.strftime('%I:%M:%S %p'),
-                          'Journal Date': jdt.strftime('%d/%b/%Y'), 'Completion Status': 'In Progress', 
-                          'Number of Findings': 0, 'Number of Transaction': 0}
-                    if update_data(conn, pd.concat([tasks_df, pd.DataFrame([nr])], ignore_index=True), "Tasks"):
-                        st.success("Assigned!"); time.sleep(2); st.rerun()
+                    if append_task(tasks_df, tgt, typ, brn, jdt): notify("Assigned!")
 
         # 5. SQL
         with tabs[4]:
             q = st.text_area("SQL", "SELECT * FROM df")
             if st.button("Run"):
-                try:
-                    c = sqlite3.connect(':memory:'); tasks_df.to_sql('df', c, index=False)
-                    st.dataframe(pd.read_sql_query(q, c))
+                df = tasks_df[[col for col in tasks_df.columns if not col.startswith('_')]]
+                try: st.dataframe(run_sql(df, q))
                 except Exception as e: st.error(e)
 
         # 6. Users
@@ -272,8 +484,8 @@ def main():
             with st.form("new_usr"):
                 u = st.text_input("User"); p = st.text_input("Pass"); r = st.selectbox("Role", ["User", "Admin"])
                 if st.form_submit_button("Add"):
-                    if update_data(conn, pd.concat([users_df, pd.DataFrame([{'Username':u,'Password':p,'Role':r}])], ignore_index=True), "Users"):
-                        st.success("Added"); st.rerun()
+                    if append_row(users_df, {'Username':u,'Password':p,'Role':r}, "Users"):
+                        notify("Added")
             st.dataframe(users_df)
 
         # 7. REPORT
@@ -283,132 +495,91 @@ def main():
                 with st.form("rep_form"):
                     col_r1, col_r2 = st.columns(2)
                     with col_r1:
-                        d1 = sorted(tasks_df_logic['Journal Date'].dropna().dt.date.unique()) if 'Journal Date' in tasks_df_logic else []
+                        d1 = date_options(tasks_df_logic['_journal_day']) if '_journal_day' in tasks_df_logic else []
                         s_jd = st.multiselect("Journal Date", d1)
                     with col_r2:
-                        d2 = sorted(tasks_df_logic['Assigned Date'].dropna().dt.date.unique()) if 'Assigned Date' in tasks_df_logic else []
+                        d2 = date_options(tasks_df_logic['_assigned_day']) if '_assigned_day' in tasks_df_logic else []
                         s_ad = st.multiselect("Assigned Date", d2)
 
                     col_r3, col_r4 = st.columns(2)
                     with col_r3:
-                        opts = list(tasks_df_logic['Branch'].unique()) if 'Branch' in tasks_df_logic else []
+                        opts = tasks_df_logic['Branch'].cat.categories.tolist()
                         s_br = st.multiselect("Branch", opts)
                     with col_r4:
-                        opts = list(tasks_df_logic['Task Description'].unique()) if 'Task Description' in tasks_df_logic else []
+                        opts = tasks_df_logic['Task Description'].cat.categories.tolist()
                         s_tk = st.multiselect("Task", opts)
 
                     col_r5, col_r6 = st.columns(2)
                     with col_r5:
-                        opts = list(tasks_df_logic['Employee'].unique()) if 'Employee' in tasks_df_logic else []
+                        opts = tasks_df_logic['Employee'].cat.categories.tolist()
                         s_em = st.multiselect("Employee", opts)
                     with col_r6:
-                        opts = ["Completed", "In Progress"]
-                        s_st = st.multiselect("Status", opts)
+                        s_st = st.multiselect("Status", STATUS_OPTIONS)
 
                     submitted = st.form_submit_button("🚀 Generate Report", type="primary")
 
             if submitted:
-                rep_df = tasks_df_logic.copy()
-                
                 # Apply Filters
-                if s_jd: rep_df = rep_df[rep_df['Journal Date'].dt.date.isin(s_jd)]
-                if s_ad: rep_df = rep_df[rep_df['Assigned Date'].dt.date.isin(s_ad)]
-                if s_br: rep_df = rep_df[rep_df['Branch'].isin(s_br)]
-                if s_tk: rep_df = rep_df[rep_df['Task Description'].isin(s_tk)]
-                if s_em: rep_df = rep_df[rep_df['Employee'].isin(s_em)]
-                if s_st: rep_df = rep_df[rep_df['Completion Status'].isin(s_st)]
-
-                # Format Dates
-                for c in ['Assigned Date', 'Journal Date']:
-                    if c in rep_df.columns: rep_df[c] = rep_df[c].dt.strftime('%d/%b/%Y')
-
-                # Create Summary with EMOJIS
-                summ = rep_df.groupby('Employee').apply(lambda x: pd.Series({
-                    'Completed ✅': (x['Completion Status']=='Completed').sum(),
-                    'Pending ⏳': (x['Completion Status']!='Completed').sum(),
-                    'Total 💼': len(x)
-                })).reset_index()
-                summ['Progress %'] = (summ['Completed ✅'] / summ['Total 💼']).fillna(0)
-
-                # Show Preview
-                st.subheader("Preview: Summary")
-                st.dataframe(summ.style.bar(subset=['Progress %'], color='#90EE90', vmin=0, vmax=1), use_container_width=True)
+                mask = np.ones(len(tasks_df_logic), dtype=bool)
+                if s_jd: mask &= tasks_df_logic['_journal_day'].isin(pd.to_datetime(s_jd)).to_numpy()
+                if s_ad: mask &= tasks_df_logic['_assigned_day'].isin(pd.to_datetime(s_ad)).to_numpy()
+                if s_br: mask &= tasks_df_logic['Branch'].isin(s_br).to_numpy()
+                if s_tk: mask &= tasks_df_logic['Task Description'].isin(s_tk).to_numpy()
+                if s_em: mask &= tasks_df_logic['Employee'].isin(s_em).to_numpy()
+                if s_st: mask &= tasks_df_logic['Completion Status'].isin(s_st).to_numpy()
+                if not mask.any(): st.info("No tasks match these filters.")
+                else:
+                    rep_df = tasks_df_logic.loc[mask].copy()
+
+                    # Format Dates
+                    for c in ['Assigned Date', 'Journal Date']:
+                        if c in rep_df.columns: rep_df[c] = format_dates(rep_df[c])
+
+                    # Create Summary with EMOJIS
+                    g = rep_df.groupby('Employee', observed=True)['_completed'].agg(['sum', 'size'])
+                    summ = pd.DataFrame({'Completed ✅': g['sum'], 'Pending ⏳': g['size'] - g['sum'], 'Total 💼': g['size']}).reset_index()
+                    summ['Progress %'] = summ['Completed ✅'] / summ['Total 💼']
+
+                    # Show Preview
+                    st.subheader("Preview: Summary")
+                    st.dataframe(summ.style.bar(subset=['Progress %'], color='#90EE90', vmin=0, vmax=1), use_container_width=True)
                 
-                st.subheader("Preview: Detailed Data")
-                cols = ['Assigned Date','Employee','Branch','Task Description','Journal Date','Completion Status','Number of Transaction','Number of Findings']
-                det_df = rep_df[[c for c in cols if c in rep_df.columns]].copy()
-                st.dataframe(det_df.style.map(color_status, subset=['Completion Status']), use_container_width=True)
-
-                # GENERATE EXCEL (ONE SHEET)
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    wb = writer.book
-                    ws = wb.add_worksheet('Audit Report')
-                    writer.sheets['Audit Report'] = ws
-
-                    # Formats
-                    fmt_green = wb.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'})
-                    fmt_orange = wb.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C0006'})
-
-                    # Write Summary
-                    ws.write_string(0, 0, "EXECUTIVE SUMMARY", wb.add_format({'bold':True, 'font_size':14}))
-                    summ.to_excel(writer, sheet_name='Audit Report', startrow=2, index=False)
-                    ws.conditional_format(3, 4, 3+len(summ), 4, {'type': 'data_bar', 'bar_color': '#63C384'})
-
-                    # Write Detail
-                    start_row = len(summ) + 6
-                    ws.write_string(start_row, 0, "DETAILED AUDIT LOG", wb.add_format({'bold':True, 'font_size':14}))
-                    det_df.to_excel(writer, sheet_name='Audit Report', startrow=start_row+2, index=False)
-
-                    # Highlight Status
-                    if 'Completion Status' in det_df.columns:
-                        status_col_idx = det_df.columns.get_loc('Completion Status')
-                        ws.conditional_format(start_row+3, status_col_idx, start_row+3+len(det_df), status_col_idx,
-                                              {'type': 'cell', 'criteria': '==', 'value': '"Completed"', 'format': fmt_green})
-                        ws.conditional_format(start_row+3, status_col_idx, start_row+3+len(det_df), status_col_idx,
-                                              {'type': 'cell', 'criteria': '==', 'value': '"In Progress"', 'format': fmt_orange})
-
-                    for i, col in enumerate(summ.columns): ws.set_column(i, i, 15)
-
-                st.download_button("📥 Download One-Sheet Excel", buffer.getvalue(), "Audit_Report_Merged.xlsx", "application/vnd.ms-excel")
+                    st.subheader("Preview: Detailed Data")
+                    cols = ['Assigned Date','Employee','Branch','Task Description','Journal Date','Completion Status','Number of Transaction','Number of Findings']
+                    det_df = rep_df[[c for c in cols if c in rep_df.columns]].copy()
+                    st.dataframe(det_df.style.map(color_status, subset=['Completion Status']), use_container_width=True)
+
+                    st.download_button("📥 Download One-Sheet Excel", build_report_excel(summ, det_df), "Audit_Report_Merged.xlsx", "application/vnd.ms-excel")
 
     # USER
     else:
         st.title("✅ My Audit Space")
         tabs = st.tabs(["Dashboard", "Active Tasks", "New Log"])
+        mydf = tasks_df.iloc[user_rows.get(user['Username'], [])]
+        done = mydf['_completed'].values
         with tabs[0]:
-            mydf = tasks_df[tasks_df['Employee'] == user['Username']]
             c1,c2 = st.columns(2)
-            c1.metric("Done", (mydf['Completion Status']=='Completed').sum())
-            c2.metric("Pending", (mydf['Completion Status']!='Completed').sum())
+            c1.metric("Done", done.sum())
+            c2.metric("Pending", (~done).sum())
 
         with tabs[1]:
-            act = tasks_df[(tasks_df['Employee']==user['Username']) & (tasks_df['Completion Status']!='Completed')]
+            act = mydf[~done]
             if act.empty: st.success("Caught up!")
-            for idx, row in act.iterrows():
-                with st.expander(f"{row['Task Description']} @ {row['Branch']}"):
+            for idx, task, branch, assigned_dt in act[['Task Description', 'Branch', '_assigned_dt']].itertuples(index=True, name=None):
+                with st.expander(f"{task} @ {branch}"):
                     with st.form(key=f"usr_{idx}"):
                         c1,c2 = st.columns(2)
                         nt = c1.number_input("Trans", value=0); nf = c2.number_input("Finds", value=0)
                         if st.form_submit_button("✅ Done"):
-                            now = get_current_time()
-                            cd, ct = now.strftime('%d/%b/%Y'), now.strftime('%I:%M:%S %p')
-                            dur = calculate_duration(row.get('Assigned Date'), row.get('Assigned Time'), cd, ct)
-                            tasks_df.loc[idx, ['Number of Transaction','Number of Findings','Completion Status','Completion Date','Completion Time','Duration','Progress %']] = [nt, nf, 'Completed', cd, ct, dur, 1]
-                            if update_data(conn, tasks_df, "Tasks"): st.balloons(); time.sleep(2); st.rerun()
+                            mark_complete(tasks_df, idx, nt, nf, assigned_dt)
+                            if update_rows(tasks_df, {idx: COMPLETION_FIELDS}, "Tasks"): notify(None, balloons=True)
         
         with tabs[2]:
             with st.form("quick_log"):
                 c1,c2 = st.columns(2)
                 b = c1.selectbox("Branch", BRANCH_OPTIONS); t = c2.selectbox("Task", TASK_OPTIONS); d = c1.date_input("Journal Date")
                 if st.form_submit_button("Start"):
-                    now = get_current_time()
-                    nr = {'Employee': user['Username'], 'Task Description': t, 'Branch': b, 
-                          'Assigned Date': now.strftime('%d/%b/%Y'), 'Assigned Time': now.strftime('%I:%M:%S %p'),
-                          'Journal Date': d.strftime('%d/%b/%Y'), 'Completion Status': 'In Progress', 
-                          'Number of Findings': 0, 'Number of Transaction': 0}
-                    if update_data(conn, pd.concat([tasks_df, pd.DataFrame([nr])], ignore_index=True), "Tasks"):
-                        st.success("Started"); time.sleep(2); st.rerun()
+                    if append_task(tasks_df, user['Username'], t, b, d): notify("Started")
 
 if __name__ == "__main__":
     main()